@@ -0,0 +1,150 @@
+# memoization of per-node results, keyed by the row set of a node
+
+import itertools
+from collections import OrderedDict
+
+_root_tokens = itertools.count()    # process-wide, never reused
+
+def fingerprint(dataset):
+    '''
+    Fingerprint of the rows of a dataset
+        - instances are identified by object id, in order and with duplicates
+    '''
+    return tuple(id(instance) for instance in dataset)
+
+
+class SplitCache:
+    '''
+    Bounded LRU cache of node results
+        - class histogram of a node
+        - impurity of a node per measure
+        - best split of a node per attribute: (pivot, gain) of strategy
+
+    A node is keyed by (root, path)
+        - root is a token given to the dataset build_tree starts with,
+          fingerprinted once by register(); tokens are unique across
+          caches and clear(), so a key never aliases another dataset
+        - path is the decisions [(attr, pivot, branch), ...] from the root,
+          which determine the row indices of the node
+    so a lookup costs O(depth) instead of O(rows of node)
+
+    NOTE: partitioned clusters of strategy are not kept, build_tree
+          re-partitions the node by the chosen split
+    NOTE: a registered dataset is an LRU entry too, it is referenced until
+          evicted such that ids inside a fingerprint are not reused by other
+          objects; rows are assumed not to be modified in place
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize   = maxsize
+        self.entries   = OrderedDict()
+        self.roots     = {}     # root token -> fingerprint, of live roots
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+
+    def register(self, dataset):
+        '''
+        Key of the root node of dataset
+        '''
+        fp    = fingerprint(dataset)
+        entry = self._lookup(('root', fp))
+        if entry is None:
+            entry = (_root_tokens.next(), dataset)
+            self.roots[entry[0]] = fp
+            self._store(('root', fp), entry)
+        return entry[0], ()
+
+
+    def registered(self, key):
+        '''
+        Whether key belongs to a root registered and not yet evicted
+        '''
+        return key is not None and self.roots.has_key(key[0])
+
+
+    def child_key(self, key, attr, pivot, val):
+        '''
+        Key of the branch val of node key, decided by (attr, pivot)
+        '''
+        if isinstance(pivot, list):
+            pivot = None    # multi-way split, branch val is enough
+        root, path = key
+        return root, path + ((attr, pivot, val),)
+
+
+    def _lookup(self, key):
+        if self.entries.has_key(key):
+            self.hits += 1
+            # re-insert as the most recently used
+            result = self.entries.pop(key)
+            self.entries[key] = result
+            return result
+
+        self.misses += 1
+        return None
+
+
+    def _store(self, key, result):
+        self.entries[key] = result
+        while len(self.entries) > self.maxsize:
+            old_key, old_result = self.entries.popitem(last=False)
+            if old_key[0] == 'root':
+                # entries of the root are unreachable from now on
+                self.roots.pop(old_result[0], None)
+            self.evictions += 1
+        return result
+
+
+    def histogram(self, key, dataset, cls_attr):
+        '''
+        Class freq of node key: {cls: freq, ...}
+        '''
+        if not self.registered(key):
+            raise KeyError('node %r is not of a root registered in this cache' % (key,))
+
+        key    = ('histogram', key, cls_attr)
+        result = self._lookup(key)
+        if result is None:
+            import measure
+            result = self._store(key, measure.histogram(dataset, cls_attr))
+        return result
+
+
+    def impurity(self, key, dataset, cls_attr, measure):
+        key    = ('impurity', key, cls_attr, measure)
+        result = self._lookup(key)
+        if result is None:
+            result = self._store(key, measure(dataset, cls_attr))
+        return result
+
+
+    def split(self, key, dataset, attr, strategy, _cmp, cls_attr, measure, impurity):
+        '''
+        Result of strategy on attr of node key: (pivot, gain)
+        '''
+        key    = ('split', key, attr, strategy, _cmp, cls_attr, measure)
+        result = self._lookup(key)
+        if result is None:
+            pivot, gain, cluster = strategy(
+                dataset, attr, cls_attr, measure, impurity, _cmp)
+            result = self._store(key, (pivot, gain))
+        return result
+
+
+    def stats(self):
+        return {
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'size':      len(self.entries),
+        }
+
+
+    def clear(self):
+        self.entries.clear()
+        self.roots.clear()
+        self.hits = self.misses = self.evictions = 0
+# end SplitCache
@@ -7,9 +7,11 @@ class TreeNode:
     def __init__(self):
         self.cls_attr = None
         self.depth    = None
+        self.key      = None # node key of cache.SplitCache, if built with
 
         self.cls      = None # only leaf node contains class label
         self.cluster  = None # only leaf node contains cluster
+        self.freq     = None # only leaf node, histogram of cluster if kept
 
         self.pivot    = None # only internal node contains pivot
         self.attr     = None # only internal node contains attr for decision
@@ -26,18 +28,31 @@ class TreeNode:
             return s
 
 
-    def majority(self):
+    def histogram(self, cache=None):
         '''
-        Interpret the class of self containted cluster, based on majority rule
+        Class freq of self containted cluster
+            - with cache, it is kept on self (and memoized in cache
+              if self is built with it)
         '''
-        freq = {}
+        if self.freq is not None:
+            return self.freq
 
-        for instance in self.cluster:
-            cls = instance[self.cls_attr]
-            if freq.has_key(cls):
-                freq[cls] += 1
-            else:
-                freq[cls] = 1
+        if cache is not None and cache.registered(self.key):
+            freq = cache.histogram(self.key, self.cluster, self.cls_attr)
+        else:
+            import measure
+            freq = measure.histogram(self.cluster, self.cls_attr)
+
+        if cache is not None:
+            self.freq = freq
+        return freq
+
+
+    def majority(self, cache=None):
+        '''
+        Interpret the class of self containted cluster, based on majority rule
+        '''
+        freq = self.histogram(cache)
 
         max_cls = None
         max_f   = .0
@@ -59,7 +74,7 @@ class TreeNode:
             return deepest
 
 
-    def merge_deepest(self, deepest):
+    def merge_deepest(self, deepest, cache=None):
         if self.depth + 1 == deepest:
             if self.cls is None:
                 # do merge for "deepest" internal node
@@ -67,28 +82,37 @@ class TreeNode:
                 for b in self.branches.values():
                     self.cluster += b.cluster
 
-                self.cls      = self.majority()
+                if cache is not None:
+                    # histogram of the merged cluster from those of branches
+                    self.freq = {}
+                    for b in self.branches.values():
+                        for cls, f in b.histogram(cache).items():
+                            self.freq[cls] = self.freq.get(cls, 0) + f
+
+                self.cls      = self.majority(cache)
                 self.pivot    = self.attr = None
                 self.branches = None # gc branches
         else:
             if self.cls is None:
                 for b in self.branches.values():
-                    b.merge_deepest(deepest)
+                    b.merge_deepest(deepest, cache)
 
 
-    def trim_last_lvl(self):
+    def trim_last_lvl(self, cache=None):
         deepest = self.probe_deepest()
-        self.merge_deepest(deepest)
+        self.merge_deepest(deepest, cache)
 
 
     def clone(self):
         c = TreeNode()
         c.cls_attr = self.cls_attr
         c.depth    = self.depth
+        c.key      = self.key
 
         if self.cls is not None:
             c.cls = self.cls
             c.cluster = self.cluster[:]
+            c.freq = self.freq
 
             c.pivot = c.attr = c.branches = None
         else:
@@ -102,12 +126,92 @@ class TreeNode:
 # end TreeNode
 
 
-def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, quiet=True, _depth=0):
+def best_split(dataset, attr_strategy, cls_attr, measure, impurity, cache=None, key=None):
+    '''
+    Score every attribute by its strategy and pick the one of best purity gain
+        returns (attr, pivot, gain, clusters), attr is None if nothing gains
+        - strategy results are memoized in cache under node key, if given,
+          clusters is None then, the node is to be partition()-ed
+    '''
+    # get all gains
+    attr_gain_map = {}
+    for attr, strategy, _cmp in attr_strategy:
+        if cache is not None and key is not None:
+            attr_gain_map[attr] = cache.split(
+                key, dataset, attr, strategy, _cmp, cls_attr, measure, impurity) + (None,)
+        else:
+            attr_gain_map[attr] = strategy(
+                dataset, attr, cls_attr, measure, impurity, _cmp)
+
+    # retrieve best gain
+    best_gain = .0
+    best_attr = None
+    pivot     = None
+    clusters  = None
+    for attr, result in attr_gain_map.items():
+        p, g, c = result
+        if g > best_gain:
+            best_attr = attr
+            pivot     = p
+            best_gain = g
+            clusters  = c
+
+    return best_attr, pivot, best_gain, clusters
+
+
+def partition(dataset, attr, pivot):
+    '''
+    Apply a decision (attr, pivot) to the dataset, in the same way
+    make_decision routes an instance
+        - multi-way split (pivot is a list): {val: cluster, ...}
+        - binary split: {0: val >= pivot, 1: val < pivot}
+    '''
+    if isinstance(pivot, list):
+        clusters = {}
+        for instance in dataset:
+            val = instance[attr]
+            if not clusters.has_key(val):
+                clusters[val] = []
+            clusters[val].append(instance)
+    else:
+        clusters = {0: [], 1: []}
+        for instance in dataset:
+            if instance[attr] < pivot:
+                clusters[1].append(instance)
+            else:
+                clusters[0].append(instance)
+
+    return clusters
+
+
+def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, quiet=True,
+               sample_cutoff=None, sample_size=1000, seed=None, sample_stats=None,
+               cache=None, _depth=0, _rng=None, _key=None):
     '''
     Build a tree of decisions based on given the dataset to carry classification
     Each tree node is a function to partition the dataset
     Each leave node is a class
         - attr_strategy is a list of tuple: [(attr, strategy, sorting fn), ...]
+
+    Split estimation by row-sampling (disabled when sample_cutoff is None)
+        - node having more than sample_cutoff instances picks its split from
+          a random subsample of sample_size instances, the chosen split is
+          then applied to all instances of the node
+        - sample_size must be a positive int (a count, not a fraction)
+          when sample_cutoff is set
+        - seed makes the subsample reproducible
+        - sample_stats, if a dict is given, is filled with
+          {'sampled': nodes split by sample, 'differed': nodes where the
+          sampled attr / pivot differs from the exact one}
+          NOTE: collecting sample_stats also scores the exact split
+        - a sample without any gain on an impure node falls back to
+          the exact split, an unlucky sample does not collapse a subtree
+
+    Memoization (disabled when cache is None)
+        - cache is a cache.SplitCache, it holds the class histogram, impurity
+          and strategy results of each node, to be reused by later
+          build_tree / pruning_tree calls on the same dataset
+        - each node carries its cache key for pruning_tree to look up
     '''
     if not quiet:
         pad = ''
@@ -121,11 +225,29 @@ def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, qui
         import measure as m
         measure = m.entropy
 
+    if _rng is None:
+        # top-level call
+        if sample_cutoff is not None and (
+                not isinstance(sample_size, (int, long))
+                or isinstance(sample_size, bool) or sample_size <= 0):
+            raise ValueError('sample_size must be a positive int, got %r' % sample_size)
+
+        import random
+        _rng = random.Random(seed)
+
+    if cache is not None and _key is None:
+        _key = cache.register(dataset)
+
+    if sample_stats is not None:
+        sample_stats.setdefault('sampled',  0)
+        sample_stats.setdefault('differed', 0)
+
     # if no more element for decision
     # return a leaf node for unclassified
     if len(dataset) == 0:
         leaf         = TreeNode()
         leaf.depth   = _depth
+        leaf.key     = _key
         leaf.cluster = []
         leaf.cls     = 'Un-classified'
 
@@ -138,26 +260,35 @@ def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, qui
     if len(attr_strategy) == 0:
         leaf          = TreeNode()
         leaf.depth    = _depth
+        leaf.key      = _key
         leaf.cluster  = dataset
         leaf.cls_attr = cls_attr
-        leaf.cls      = leaf.majority()
+        leaf.cls      = leaf.majority(cache)
 
         if not quiet:
             print '%sleaf - %s by majority [no attr left]' % (pad, leaf.cls)
         return leaf
 
     # compute impurity for further processing
-    impurity = measure(dataset, cls_attr)
+    if cache is not None:
+        impurity = cache.impurity(_key, dataset, cls_attr, measure)
+    else:
+        impurity = measure(dataset, cls_attr)
 
     # if impurity of dataset is 0 ==> all instances belong to same class
     # return a leaf node as of that class
     if impurity == 0:
         leaf          = TreeNode()
         leaf.depth    = _depth
+        leaf.key      = _key
         leaf.cluster  = dataset
         leaf.cls_attr = cls_attr
         leaf.cls      = dataset[0][cls_attr]
 
+        if cache is not None:
+            # histogram of a pure cluster comes for free
+            leaf.freq = {leaf.cls: len(dataset)}
+
         if not quiet:
             print '%sleaf - %s' % (pad, leaf.cls)
         return leaf
@@ -167,9 +298,10 @@ def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, qui
     elif impurity < threshold:
         leaf          = TreeNode()
         leaf.depth    = _depth
+        leaf.key      = _key
         leaf.cluster  = dataset
         leaf.cls_attr = cls_attr
-        leaf.cls      = leaf.majority()
+        leaf.cls      = leaf.majority(cache)
 
         if not quiet:
             print '%sleaf - %s by majority [threshold reach]' % (pad, leaf.cls)
@@ -177,38 +309,64 @@ def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, qui
 
     # pick a partition strategy by the best purity gain
     else:
-        # get all gains
-        attr_gain_map = {}
-        for attr, strategy, _cmp in attr_strategy:
-            attr_gain_map[attr] = strategy(
-                dataset, attr, cls_attr, measure, impurity, _cmp)
+        sampled = sample_cutoff is not None \
+            and len(dataset) > max(sample_cutoff, sample_size)
+
+        if sampled:
+            # estimate the split from a subsample of the node
+            sample = _rng.sample(dataset, sample_size)
+            best_attr, pivot, best_gain, clusters = best_split(
+                sample, attr_strategy, cls_attr, measure,
+                measure(sample, cls_attr))
+            clusters = None # clusters of the sample only
+
+            if best_attr is None:
+                # sample gains nothing but the node is impure, do it exact
+                sampled = False
+                best_attr, pivot, best_gain, clusters = best_split(
+                    dataset, attr_strategy, cls_attr, measure, impurity, cache, _key)
+
+            if sampled and sample_stats is not None:
+                e_attr, e_pivot, e_gain, e_clusters = best_split(
+                    dataset, attr_strategy, cls_attr, measure, impurity, cache, _key)
+                if isinstance(e_pivot, list):
+                    e_pivot = sorted(e_pivot)
+                if isinstance(pivot, list):
+                    # the sample may miss some values of the node
+                    s_pivot = sorted(set(i[best_attr] for i in dataset))
+                else:
+                    s_pivot = pivot
 
-        # retrieve best gain
-        best_gain = .0
-        best_attr = None
-        pivot     = None
-        clusters  = None
-        for attr, result in attr_gain_map.items():
-            p, g, c = result
-            if g > best_gain:
-                best_attr = attr
-                pivot     = p
-                best_gain = g
-                clusters  = c
+                sample_stats['sampled'] += 1
+                if (e_attr, e_pivot) != (best_attr, s_pivot):
+                    sample_stats['differed'] += 1
+        else:
+            best_attr, pivot, best_gain, clusters = best_split(
+                dataset, attr_strategy, cls_attr, measure, impurity, cache, _key)
 
         if best_attr is None:
             # early return for gaining not much purity
             leaf          = TreeNode()
             leaf.depth    = _depth
+            leaf.key      = _key
             leaf.cluster  = dataset
             leaf.cls_attr = cls_attr
-            leaf.cls      = leaf.majority()
+            leaf.cls      = leaf.majority(cache)
 
             if not quiet:
                 print '%sleaf - %s by majority [no further gain]' % (pad, leaf.cls)
             return leaf
 
+        if clusters is None:
+            # split is estimated by sample or memoized, apply it to the node
+            clusters = partition(dataset, best_attr, pivot)
+            if isinstance(pivot, list):
+                pivot = clusters.keys()
+
         if not quiet:
+            if sampled:
+                print '%sestimated by %s of %s instances' \
+                    % (pad, sample_size, len(dataset))
             if isinstance(pivot, list):
                 print '%simpurity: %s, gain: %s, attr: %s, decision: by %s' \
                     % (pad, impurity, best_gain, best_attr, pivot)
@@ -223,13 +381,22 @@ def build_tree(dataset, cls_attr, attr_strategy, measure=None, threshold=.0, qui
         tree = TreeNode()
         tree.cls_attr = cls_attr
         tree.depth    = _depth
+        tree.key      = _key
         tree.pivot    = pivot
         tree.attr     = best_attr
         tree.branches = {}
 
         for val, c in clusters.items():
+            if cache is not None:
+                c_key = cache.child_key(_key, best_attr, pivot, val)
+            else:
+                c_key = None
+
             tree.branches[val] = build_tree(
-                c, cls_attr, attr_strategy, measure, threshold, quiet, _depth+1)
+                c, cls_attr, attr_strategy, measure, threshold, quiet,
+                sample_cutoff=sample_cutoff, sample_size=sample_size,
+                sample_stats=sample_stats, cache=cache, _depth=_depth+1, _rng=_rng,
+                _key=c_key)
 
         return tree
 
@@ -265,13 +432,17 @@ def make_decision(tree, instance):
     return node.cls
 
 
-def pruning_tree(tree, dataset, cls_attr, penalty=.5, quiet=True):
+def pruning_tree(tree, dataset, cls_attr, penalty=.5, quiet=True, cache=None):
     '''
     Post-pruning a decision tree by err-estimate on data set
         pessimistic err-estimate =
             err-instances + leaf-count * size-penalty / data-set-size
 
         Continues pruning tree when trimmed-lvl-err-estimate < last-lvl-err-estimate
+
+        with cache (a cache.SplitCache), class histogram of a merged cluster is
+        summed up from those of branches, kept on leaf nodes of tree built with
+        the cache (or computed once, memoized in the cache if registered there)
     '''
     tree = tree.clone()
     size = len(dataset)
@@ -304,13 +475,13 @@ def pruning_tree(tree, dataset, cls_attr, penalty=.5, quiet=True):
         otree = tree.clone()
         o_estimate = estimate
 
-        tree.trim_last_lvl()
+        tree.trim_last_lvl(cache)
 
     return otree
 
 
 def __test__():
-    import measure, strategy, datetime
+    import measure, strategy, cache, datetime, time
 
     f = open('poker-hand-training.data')
     data = []
@@ -319,7 +490,7 @@ def __test__():
     f.close()
 
 
-    tree = build_tree(data, 10, [
+    attr_strategy = [
         (0, strategy.nominal,  None),
         (1, strategy.interval, None),
         (2, strategy.nominal,  None),
@@ -330,8 +501,31 @@ def __test__():
         (7, strategy.interval, None),
         (8, strategy.nominal,  None),
         (9, strategy.interval, None),
-    ], quiet=True)
-    print 'Tree size: %d' % tree.size()
+    ]
+
+    start = time.time()
+    tree = build_tree(data, 10, attr_strategy, quiet=True)
+    print 'Tree size: %d [%.2fs]' % (tree.size(), time.time() - start)
+
+    # row-sampling, timed without sample_stats (which scores exact splits too)
+    start = time.time()
+    s_tree = build_tree(data, 10, attr_strategy, quiet=True,
+                        sample_cutoff=5000, sample_size=2000, seed=0)
+    print 'Tree size (row-sampling): %d [%.2fs]' % \
+        (s_tree.size(), time.time() - start)
+
+    sample_stats = {}
+    build_tree(data, 10, attr_strategy, quiet=True,
+               sample_cutoff=5000, sample_size=2000, seed=0,
+               sample_stats=sample_stats)
+    print 'Split estimated by sample: %d, differed from exact: %d' % \
+        (sample_stats['sampled'], sample_stats['differed'])
+
+    for size in (0, None, 0.1):
+        try:
+            build_tree(data, 10, attr_strategy, sample_cutoff=5000, sample_size=size)
+        except ValueError, e:
+            print 'Rejected: %s' % e
 
     _tree = pruning_tree(tree, data, 10, quiet=False)
     print 'Tree size: %d' % _tree.size()
@@ -339,6 +533,86 @@ def __test__():
     _tree = pruning_tree(tree, data, 10, 1.0, quiet=False)
     print 'Tree size: %d' % _tree.size()
 
+    # memoization by cache.SplitCache
+    def same_tree(a, b):
+        if a.cls != b.cls or a.attr != b.attr:
+            return False
+        if isinstance(a.pivot, list) and isinstance(b.pivot, list):
+            if sorted(a.pivot) != sorted(b.pivot):
+                return False
+        elif a.pivot != b.pivot:
+            return False
+        if a.branches is None or b.branches is None:
+            return a.branches is b.branches
+        if sorted(a.branches.keys()) != sorted(b.branches.keys()):
+            return False
+        for val, branch in a.branches.items():
+            if not same_tree(branch, b.branches[val]):
+                return False
+        return True
+
+    def hit_rate(before, after):
+        hits   = after['hits']   - before['hits']
+        misses = after['misses'] - before['misses']
+        return 100.0 * hits / max(hits + misses, 1)
+
+    subset      = data[:6000]
+    split_cache = cache.SplitCache(maxsize=100000)
+
+    start = time.time()
+    tree  = build_tree(subset, 10, attr_strategy)
+    print 'Tree size (no cache): %d [%.2fs]' % (tree.size(), time.time() - start)
+
+    start   = time.time()
+    c_tree  = build_tree(subset, 10, attr_strategy, cache=split_cache)
+    print 'Tree size (cold cache): %d [%.2fs], same as no cache: %s' % \
+        (c_tree.size(), time.time() - start, same_tree(tree, c_tree))
+
+    # rerun with a different threshold
+    tree   = build_tree(subset, 10, attr_strategy, threshold=.5)
+    before = split_cache.stats()
+    start  = time.time()
+    c_tree = build_tree(subset, 10, attr_strategy, threshold=.5, cache=split_cache)
+    print 'Tree size (warm cache, threshold .5): %d [%.2fs], hit rate: %.1f%%, ' \
+          'same as no cache: %s' % (c_tree.size(), time.time() - start,
+          hit_rate(before, split_cache.stats()), same_tree(tree, c_tree))
+
+    # post-pruning, merges sum up histograms of branches
+    for penalty in (.5, 1.0):
+        start = time.time()
+        _tree = pruning_tree(tree, subset, 10, penalty)
+        print 'Pruned size (no cache, penalty %s): %d [%.2fs]' % \
+            (penalty, _tree.size(), time.time() - start)
+
+        start   = time.time()
+        _c_tree = pruning_tree(c_tree, subset, 10, penalty, cache=split_cache)
+        print 'Pruned size (cache, penalty %s): %d [%.2fs], same as no cache: %s' % \
+            (penalty, _c_tree.size(), time.time() - start, same_tree(_tree, _c_tree))
+
+    # duplicated rows: same set of row objects, different multiplicity
+    a, b = subset[0][:], subset[1][:]
+    a[10], b[10] = 'A', 'B'
+    ab   = split_cache.register([a, a, b])
+    abb  = split_cache.register([a, b, b])
+    print 'Histogram [a, a, b]: %s, [a, b, b]: %s' % (
+        split_cache.histogram(ab,  [a, a, b], 10),
+        split_cache.histogram(abb, [a, b, b], 10))
+
+    twice  = subset[:2000] + subset[:2000]
+    tree   = build_tree(twice, 10, attr_strategy)
+    c_tree = build_tree(twice, 10, attr_strategy, cache=split_cache)
+    print 'Tree size (duplicated rows): %d, same as no cache: %s' % \
+        (c_tree.size(), same_tree(tree, c_tree))
+    print 'Cache: %s' % split_cache.stats()
+
+    # keys of a tree built before clear() do not alias datasets built after
+    split_cache.clear()
+    o_tree = build_tree(subset[3000:4500], 10, attr_strategy, cache=split_cache)
+    print 'Key after clear(): %s, old key registered: %s, ' \
+          'pruned same as no cache: %s' % (o_tree.key, split_cache.registered(c_tree.key),
+          same_tree(pruning_tree(c_tree, twice, 10, cache=split_cache),
+                    pruning_tree(tree, twice, 10)))
+
 
 if __name__ == '__main__':
     __test__()
@@ -77,3 +77,19 @@ def cls_err(dataset, cls_attr):
         max_prob = max(max_prob, f/size)
 
     return 1 - max_prob
+
+
+def histogram(dataset, cls_attr):
+    '''
+    Class freq of the dataset: {cls: freq, ...}
+    '''
+    freq = {}   # class freq holder
+
+    for instance in dataset:
+        cls_label = instance[cls_attr]
+        if freq.has_key(cls_label):
+            freq[cls_label] += 1
+        else:
+            freq[cls_label] = 1
+
+    return freq